@@ -6,8 +6,8 @@ SnapPaste 电脑端服务器
 
 import os
 import sys
-import ssl
-import ipaddress
+import secrets
+import functools
 
 # 添加 server 目录到路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -17,20 +17,53 @@ import qrcode
 from io import StringIO
 
 from network import get_local_ip, get_server_url, get_all_local_ips
-from clipboard import image_to_clipboard, decode_base64_image
+from clipboard import image_to_clipboard, add_text_to_clipboard, can_add_text, decode_base64_image
+from recent import RecentCaptures
+from extract import TextExtractor, available_engines
+from tls import CertManager
 
 
 # 配置
 PORT = 8443  # HTTPS 默认用 8443
 STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
 CERT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "certs")
+RECENT_MAX_ITEMS = 20                  # 最近上传最多保留条数
+RECENT_MAX_BYTES = 64 * 1024 * 1024    # 最近上传（含缩略图）内存上限
+OCR_PROCESSES = 2                      # 文字识别进程数
+OCR_TIMEOUT = 15                       # 单张图片识别超时（秒）
+OCR_MAX_SIDE = 2000                    # 识别前缩小到的最长边（像素）
+OCR_MAX_PENDING = 8                    # 最多排队的识别任务数（超出则跳过）
+
+# 访问令牌：每次启动随机生成，随二维码/横幅中的 URL 发给手机；
+# 服务监听 0.0.0.0，同一局域网内的其他设备无令牌时只能上传，不能浏览最近的图片和识别文字
+ACCESS_TOKEN = secrets.token_urlsafe(16)
 
 # 创建 Flask 应用
 app = Flask(__name__, static_folder=STATIC_DIR)
 
+# 最近上传（仅内存，重启即清空）
+recent = RecentCaptures(max_items=RECENT_MAX_ITEMS, max_bytes=RECENT_MAX_BYTES)
+
+# 文字提取（--ocr 启用，默认关闭）
+extractor = None
+
+# 证书管理（本地 CA + 短期叶子证书，SSL 上下文全进程复用）
+cert_manager = CertManager(CERT_DIR)
+
 
 # ============ 路由 ============
 
+def require_token(view):
+    """要求请求携带访问令牌（X-SnapPaste-Token 头或 token 查询参数，后者供 <img> 使用）"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-SnapPaste-Token") or request.args.get("token", "")
+        if not secrets.compare_digest(token.encode(), ACCESS_TOKEN.encode()):
+            return jsonify({"success": False, "error": "Invalid token"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
 @app.route("/")
 def index():
     """提供手机端 HTML 页面"""
@@ -91,10 +124,13 @@ def upload():
         success = image_to_clipboard(image_data)
         
         if success:
+            item = recent.add(image_data)
+            extract_text_async(image_data, item["id"] if item else None)
             return jsonify({
                 "success": True, 
                 "message": "Image copied to clipboard",
-                "size": len(image_data)
+                "size": len(image_data),
+                "id": item["id"] if item else None
             })
         else:
             return jsonify({
@@ -109,12 +145,115 @@ def upload():
         }), 500
 
 
+@app.route("/api/recent")
+@require_token
+def recent_list():
+    """最近写入剪贴板的图片列表（最新在前，不含图片数据）"""
+    items, version = recent.list()
+    response = jsonify({"success": True, "items": items})
+    response.set_etag(f"recent-{version}")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route("/api/thumb/<item_id>")
+@require_token
+def recent_thumb(item_id):
+    """
+    最近图片的缩略图（JPEG）
+    
+    查询参数 size 为期望边长，向上取整到 96/256/512
+    """
+    size = request.args.get("size", 256, type=int)
+    try:
+        result = recent.thumbnail(item_id, size)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 415
+    if result is None:
+        return jsonify({"success": False, "error": "Not found"}), 404
+    
+    thumb, size = result
+    response = app.response_class(thumb, mimetype="image/jpeg")
+    # ID 即内容哈希，同一 ETag 对应的内容永远不变
+    response.set_etag(f"{item_id}-{size}")
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+
+@app.route("/api/recent/<item_id>/paste", methods=["POST"])
+@require_token
+def recent_paste(item_id):
+    """将最近的某张图片重新写入剪贴板（无需再次上传）"""
+    image_data = recent.get(item_id)
+    if image_data is None:
+        return jsonify({"success": False, "error": "Not found"}), 404
+    
+    try:
+        success = image_to_clipboard(image_data)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    
+    if success:
+        extract_text_async(image_data, item_id)
+        return jsonify({
+            "success": True,
+            "message": "Image copied to clipboard",
+            "size": len(image_data),
+            "id": item_id
+        })
+    return jsonify({
+        "success": False,
+        "error": "Failed to copy to clipboard"
+    }), 500
+
+
+def extract_text_async(image_data: bytes, item_id=None):
+    """后台识别图片中的文字，完成后追加到剪贴板（不阻塞当前请求）"""
+    if extractor is None:
+        return
+    
+    def on_text(text):
+        if item_id:
+            recent.set_text(item_id, text)
+        if add_text_to_clipboard(text, image_data):
+            print(f"[INFO] 已识别文字（{len(text)} 字），已追加到剪贴板")
+    
+    extractor.submit(image_data, on_text)
+
+
 @app.route("/api/ping")
 def ping():
     """健康检查端点"""
     return jsonify({"status": "ok", "service": "SnapPaste"})
 
 
+@app.route("/api/tls")
+def tls_stats():
+    """TLS 握手统计（完整握手 vs 会话复用）及证书到期时间"""
+    expiry = cert_manager.leaf_expiry()
+    return jsonify({
+        "handshakes": cert_manager.stats.snapshot(),
+        "cert_expires": expiry.isoformat() if expiry else None
+    })
+
+
+@app.route("/api/ca.crt")
+def ca_cert():
+    """
+    下载本地 CA 证书，手机安装并信任后，IP 变化或证书更新都不再提示
+    
+    CA 受名称约束（仅 localhost 与私有/回环地址），但私钥未加密存放在 certs/，
+    泄漏后可冒充局域网内的设备
+    """
+    der = cert_manager.ca_cert_der()
+    if der is None:
+        return jsonify({"success": False, "error": "CA not available"}), 404
+    response = app.response_class(der, mimetype="application/x-x509-ca-cert")
+    response.headers["Content-Disposition"] = 'attachment; filename="snappaste-ca.crt"'
+    return response
+
+
 # ============ 启动逻辑 ============
 
 def print_qrcode(url: str):
@@ -135,7 +274,8 @@ def print_qrcode(url: str):
 
 
 def print_banner(url: str, is_https: bool = False, all_ips = None):
-    """打印启动信息"""
+    """打印启动信息（手机访问的地址都带上访问令牌）"""
+    query = f"/?token={ACCESS_TOKEN}"
     print("\n" + "=" * 50)
     print("  SnapPaste - 手机拍照，电脑粘贴")
     print("=" * 50)
@@ -147,87 +287,70 @@ def print_banner(url: str, is_https: bool = False, all_ips = None):
         print("\n  可用地址:")
         for ip_info in all_ips:
             gateway_mark = " <- 推荐" if ip_info["has_gateway"] else ""
-            print(f"    {protocol}://{ip_info['ip']}:{port}  ({ip_info['name']}){gateway_mark}")
+            print(f"    {protocol}://{ip_info['ip']}:{port}{query}  ({ip_info['name']}){gateway_mark}")
     else:
-        print(f"\n  服务器地址: {url}")
+        print(f"\n  服务器地址: {url}{query}")
     
     if is_https:
         print("\n  [HTTPS 模式] 首次访问需信任证书")
+        print(f"  安装 {url}/api/ca.crt 后，IP 变化也不再提示")
     print("\n  用手机扫描下方二维码连接:\n")
-    print_qrcode(url)
-    print(f"\n  或在手机浏览器打开: {url}")
+    print_qrcode(url + query)
+    print(f"\n  或在手机浏览器打开: {url}{query}")
     print("\n  按 Ctrl+C 停止服务器")
     print("=" * 50 + "\n")
 
 
-def generate_self_signed_cert():
-    """生成自签名证书（如果不存在）"""
-    cert_file = os.path.join(CERT_DIR, "cert.pem")
-    key_file = os.path.join(CERT_DIR, "key.pem")
+def enable_text_extraction():
+    """启用 OCR / 条码识别（引擎缺失时给出提示并保持关闭）"""
+    global extractor
     
-    if os.path.exists(cert_file) and os.path.exists(key_file):
-        return cert_file, key_file
+    engines = available_engines()
+    if not engines:
+        print("[WARN] 未找到可用的文字识别引擎，--ocr 未生效")
+        print("[WARN] 请运行: pip install pytesseract pyzbar（并安装 Tesseract / zbar）")
+        return
     
-    # 创建证书目录
-    os.makedirs(CERT_DIR, exist_ok=True)
+    extractor = TextExtractor(
+        engines,
+        processes=OCR_PROCESSES,
+        timeout=OCR_TIMEOUT,
+        max_side=OCR_MAX_SIDE,
+        max_pending=OCR_MAX_PENDING
+    )
+    # 在 app.run 启动请求线程之前创建进程池
+    extractor.start()
+    print(f"[INFO] 文字提取已启用: {', '.join(engines)}")
     
-    try:
-        from cryptography import x509
-        from cryptography.x509.oid import NameOID
-        from cryptography.hazmat.primitives import hashes, serialization
-        from cryptography.hazmat.primitives.asymmetric import rsa
-        from datetime import datetime, timedelta
-        
-        # 生成私钥
-        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        
-        # 获取本机 IP
-        ip = get_local_ip()
-        
-        # 生成证书
-        subject = issuer = x509.Name([
-            x509.NameAttribute(NameOID.COMMON_NAME, f"SnapPaste ({ip})"),
-            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "SnapPaste"),
-        ])
-        
-        # 添加 SAN（Subject Alternative Name）以支持 IP 访问
-        san = x509.SubjectAlternativeName([
-            x509.DNSName("localhost"),
-            x509.IPAddress(ipaddress.IPv4Address(ip)),
-            x509.IPAddress(ipaddress.IPv4Address("127.0.0.1")),
-        ])
-        
-        cert = (
-            x509.CertificateBuilder()
-            .subject_name(subject)
-            .issuer_name(issuer)
-            .public_key(key.public_key())
-            .serial_number(x509.random_serial_number())
-            .not_valid_before(datetime.utcnow())
-            .not_valid_after(datetime.utcnow() + timedelta(days=365))
-            .add_extension(san, critical=False)
-            .sign(key, hashes.SHA256())
-        )
-        
-        # 保存私钥
-        with open(key_file, "wb") as f:
-            f.write(key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        
-        # 保存证书
-        with open(cert_file, "wb") as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
-        
-        print(f"[INFO] 已生成自签名证书: {cert_file}")
-        return cert_file, key_file
-        
-    except ImportError:
-        print("[WARN] 未安装 cryptography，无法生成证书")
-        print("[WARN] 请运行: pip install cryptography")
-        return None, None
+    if not can_add_text():
+        # 无法确认剪贴板归属时不追加文字，结果只记录在 /api/recent 中
+        print("[WARN] 当前环境无法在剪贴板图片旁追加文字，识别结果仅显示在最近上传列表中")
+        if sys.platform == "darwin":
+            print("[WARN] macOS 请运行: pip install pyobjc-framework-Cocoa")
+        elif sys.platform == "win32":
+            print("[WARN] Windows 请运行: pip install pywin32")
+
+
+def run_loadtest_mode(args):
+    """压测模式：使用与正常启动相同的证书和 SSL 配置"""
+    from loadtest import run_loadtest
+    
+    ssl_context = None
+    if not args.no_https:
+        ssl_context = cert_manager.ssl_context()
+        if ssl_context is None:
+            print("[WARN] 证书不可用，回退到 HTTP 模式")
+    
+    run_loadtest(
+        app,
+        clients=args.clients,
+        duration=args.duration,
+        interval=args.interval,
+        think_ms=args.think,
+        port=args.port or 0,
+        ssl_context=ssl_context,
+        cafile=cert_manager.ca_cert_file
+    )
 
 
 def main():
@@ -237,11 +360,33 @@ def main():
     parser = argparse.ArgumentParser(description="SnapPaste 服务器")
     parser.add_argument("--no-https", action="store_true", help="使用 HTTP 模式（不推荐）")
     parser.add_argument("--port", type=int, default=None, help="端口号")
+    parser.add_argument("--ocr", action="store_true", help="识别图片中的文字/二维码，作为纯文本追加到剪贴板")
+    parser.add_argument("--loadtest", action="store_true", help="压测模式：本机启动服务并模拟多个手机客户端")
+    parser.add_argument("--clients", type=int, default=10, help="压测并发客户端数")
+    parser.add_argument("--duration", type=float, default=60, help="压测时长（秒），0 表示直到 Ctrl+C")
+    parser.add_argument("--interval", type=float, default=10, help="压测报告周期（秒）")
+    parser.add_argument("--think", type=float, default=0, help="压测客户端平均上传间隔（毫秒）")
     args = parser.parse_args()
     
+    if args.ocr:
+        enable_text_extraction()
+    
+    try:
+        if args.loadtest:
+            run_loadtest_mode(args)
+        else:
+            run_server(args)
+    finally:
+        # app.run 在 Ctrl+C 后返回，此时终止识别进程池
+        if extractor is not None:
+            extractor.close()
+
+
+def run_server(args):
+    """启动 HTTPS（或 HTTP）服务器，直到 Ctrl+C"""
     # 获取所有局域网 IP
     all_ips = get_all_local_ips()
-    ip = get_local_ip()
+    ip = get_local_ip(all_ips)
     
     # 确保静态目录存在
     if not os.path.exists(STATIC_DIR):
@@ -253,15 +398,14 @@ def main():
     
     if use_https:
         # 尝试生成/加载证书
-        cert_file, key_file = generate_self_signed_cert()
+        context = cert_manager.ssl_context()
         
-        if cert_file and key_file:
+        if context is not None:
             url = f"https://{ip}:{port}"
             print_banner(url, is_https=True, all_ips=all_ips)
             
-            # 创建 SSL 上下文
-            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            context.load_cert_chain(cert_file, key_file)
+            # 长时间运行时自动续期叶子证书
+            cert_manager.start_auto_refresh()
             
             # 启动 HTTPS 服务器
             app.run(
@@ -6,9 +6,34 @@ import io
 import platform
 import subprocess
 import base64
+import threading
+from contextlib import contextmanager
 from typing import Union
 
 
+# 剪贴板后端覆盖（None 表示按平台自动选择）
+_backend = None
+
+# _owner 记录最近写入的图片及写入后的剪贴板序号，用于追加文字时确认剪贴板
+# 仍是这张图（未被用户或其他程序覆盖）。_lock 只保护真正的剪贴板写入和序号读取，
+# 图片解码/格式转换在锁外进行，并发上传互不阻塞
+_lock = threading.Lock()
+_owner = None
+
+
+def set_clipboard_backend(name: Union[str, None]):
+    """
+    指定剪贴板后端
+    
+    Args:
+        name: "noop" 只做图片格式转换、不写剪贴板（压测用）；None 恢复按平台选择
+    """
+    global _backend
+    if name not in (None, "noop"):
+        raise ValueError(f"Unknown clipboard backend: {name}")
+    _backend = name
+
+
 def image_to_clipboard(image_data: bytes) -> bool:
     """
     将图片数据直接写入系统剪贴板（内存操作，不创建临时文件）
@@ -19,6 +44,24 @@ def image_to_clipboard(image_data: bytes) -> bool:
     Returns:
         bool: 成功返回 True，失败返回 False
     """
+    return _write_image(image_data)
+
+
+@contextmanager
+def _owning(image_data: bytes):
+    """持锁执行真正的剪贴板写入，成功后记录归属"""
+    global _owner
+    with _lock:
+        _owner = None
+        yield
+        _owner = (image_data, _clipboard_sequence())
+
+
+def _write_image(image_data: bytes) -> bool:
+    """按后端/平台分发图片写入"""
+    if _backend == "noop":
+        return _noop_clipboard(image_data)
+    
     system = platform.system()
     
     if system == "Windows":
@@ -31,40 +74,86 @@ def image_to_clipboard(image_data: bytes) -> bool:
         raise NotImplementedError(f"Unsupported platform: {system}")
 
 
+def add_text_to_clipboard(text: str, image_data: bytes) -> bool:
+    """
+    在剪贴板中的图片旁追加一份纯文本格式（粘贴到文本框时得到文字）
+    
+    仅当剪贴板仍是 image_data 这张图时才追加，避免覆盖用户之后复制的内容。
+    Linux 的 xclip/xsel 每个进程只能提供一种格式，不支持追加。
+    
+    Args:
+        text: 要追加的文字
+        image_data: 之前传给 image_to_clipboard 的同一个 bytes 对象
+    
+    Returns:
+        bool: 成功追加返回 True
+    """
+    global _owner
+    with _lock:
+        if _owner is None or _owner[0] is not image_data:
+            return False
+        if _backend == "noop":
+            return True
+        
+        sequence = _owner[1]
+        if sequence is None or _clipboard_sequence() != sequence:
+            return False
+        
+        system = platform.system()
+        try:
+            if system == "Windows":
+                _windows_add_text(text)
+            elif system == "Darwin":
+                _macos_add_text(text)
+            else:
+                return False
+        except Exception as e:
+            print(f"Clipboard text error: {e}")
+            return False
+        
+        _owner = (image_data, _clipboard_sequence())
+        return True
+
+
+def can_add_text() -> bool:
+    """当前平台/环境能否在图片旁追加文字（add_text_to_clipboard 是否可能成功）"""
+    return _clipboard_sequence() is not None
+
+
+def _clipboard_sequence():
+    """剪贴板变更序号（无法获取时返回 None）"""
+    if _backend == "noop":
+        return 0
+    
+    system = platform.system()
+    try:
+        if system == "Windows":
+            import win32clipboard
+            return win32clipboard.GetClipboardSequenceNumber()
+        elif system == "Darwin":
+            from AppKit import NSPasteboard
+            return NSPasteboard.generalPasteboard().changeCount()
+    except ImportError:
+        pass
+    return None
+
+
 def _windows_clipboard(image_data: bytes) -> bool:
     """Windows: 使用 win32clipboard 直接写入剪贴板"""
     try:
         # 优先尝试 win32clipboard（更高效）
         import win32clipboard
-        from PIL import Image
         
-        # 从内存加载图片
-        img = Image.open(io.BytesIO(image_data))
-        
-        # 转换为 BMP 格式（Windows 剪贴板原生支持）
-        output = io.BytesIO()
-        # 转换为 RGB 模式（BMP 不支持 RGBA）
-        if img.mode == "RGBA":
-            # 创建白色背景
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode != "RGB":
-            img = img.convert("RGB")
-        
-        img.save(output, format="BMP")
-        bmp_data = output.getvalue()
-        
-        # BMP 文件头是 14 字节，剪贴板需要的是 DIB 数据（跳过文件头）
-        dib_data = bmp_data[14:]
+        dib_data = _to_dib(image_data)
         
         # 写入剪贴板
-        win32clipboard.OpenClipboard()
-        try:
-            win32clipboard.EmptyClipboard()
-            win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib_data)
-        finally:
-            win32clipboard.CloseClipboard()
+        with _owning(image_data):
+            win32clipboard.OpenClipboard()
+            try:
+                win32clipboard.EmptyClipboard()
+                win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib_data)
+            finally:
+                win32clipboard.CloseClipboard()
         
         return True
         
@@ -73,6 +162,55 @@ def _windows_clipboard(image_data: bytes) -> bool:
         return _windows_powershell(image_data)
 
 
+def _to_dib(image_data: bytes) -> bytes:
+    """将图片转换为 DIB 数据（Windows 剪贴板 CF_DIB 格式）"""
+    from PIL import Image
+    
+    # 从内存加载图片
+    img = Image.open(io.BytesIO(image_data))
+    
+    # 转换为 BMP 格式（Windows 剪贴板原生支持）
+    output = io.BytesIO()
+    # 转换为 RGB 模式（BMP 不支持 RGBA）
+    if img.mode == "RGBA":
+        # 创建白色背景
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    
+    img.save(output, format="BMP")
+    bmp_data = output.getvalue()
+    
+    # BMP 文件头是 14 字节，剪贴板需要的是 DIB 数据（跳过文件头）
+    return bmp_data[14:]
+
+
+def _noop_clipboard(image_data: bytes) -> bool:
+    """空后端：走一遍与 Windows 相同的解码/转换流程，但不写入剪贴板"""
+    try:
+        _to_dib(image_data)
+    except Exception as e:
+        print(f"Noop clipboard error: {e}")
+        return False
+    
+    with _owning(image_data):
+        pass
+    return True
+
+
+def _windows_add_text(text: str):
+    """Windows: 不清空剪贴板，直接追加 CF_UNICODETEXT"""
+    import win32clipboard
+    
+    win32clipboard.OpenClipboard()
+    try:
+        win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, text)
+    finally:
+        win32clipboard.CloseClipboard()
+
+
 def _windows_powershell(image_data: bytes) -> bool:
     """Windows 备用方案：通过 PowerShell 写入剪贴板"""
     try:
@@ -161,11 +299,12 @@ def _macos_clipboard(image_data: bytes) -> bool:
         try:
             from AppKit import NSPasteboard, NSPasteboardTypeTIFF, NSData
             
-            pasteboard = NSPasteboard.generalPasteboard()
-            pasteboard.clearContents()
-            
             ns_data = NSData.dataWithBytes_length_(tiff_data, len(tiff_data))
-            pasteboard.setData_forType_(ns_data, NSPasteboardTypeTIFF)
+            
+            with _owning(image_data):
+                pasteboard = NSPasteboard.generalPasteboard()
+                pasteboard.clearContents()
+                pasteboard.setData_forType_(ns_data, NSPasteboardTypeTIFF)
             return True
         except ImportError:
             print("macOS requires PyObjC for clipboard image support")
@@ -176,6 +315,16 @@ def _macos_clipboard(image_data: bytes) -> bool:
         return False
 
 
+def _macos_add_text(text: str):
+    """macOS: 在当前 pasteboard 内容上追加字符串类型"""
+    from AppKit import NSPasteboard, NSPasteboardTypeString
+    
+    pasteboard = NSPasteboard.generalPasteboard()
+    pasteboard.addTypes_owner_([NSPasteboardTypeString], None)
+    if not pasteboard.setString_forType_(text, NSPasteboardTypeString):
+        raise RuntimeError("setString:forType: failed")
+
+
 def decode_base64_image(data: Union[str, bytes]) -> bytes:
     """
     解码 Base64 图片数据
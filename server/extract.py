@@ -0,0 +1,250 @@
+"""
+文字提取模块 - 在独立进程池中对图片做 OCR / 条码识别（可选功能）
+
+依赖（均为可选，缺失时对应引擎自动禁用）:
+- OCR: pytesseract + 系统安装的 Tesseract
+- 条码/二维码: pyzbar + 系统安装的 zbar
+
+识别在后台进行，不阻塞图片写入剪贴板；结果按内容哈希缓存。
+"""
+
+import io
+import time
+import signal
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+# 优先使用的 OCR 语言（取与本机已安装语言包的交集）
+OCR_LANGS = ("chi_sim", "eng")
+
+# 等待结果时检查进程池是否已被其他任务终止的间隔（秒）
+POLL_INTERVAL = 0.2
+
+# tesseract 子进程的超时比任务超时提前的秒数：由 pytesseract 自行结束 tesseract，
+# 否则终止进程池时 tesseract 会成为孤儿进程继续占用 CPU
+TESSERACT_MARGIN = 1.0
+
+
+def available_engines() -> tuple:
+    """
+    检测本机可用的识别引擎
+
+    Returns:
+        tuple: ("barcode", "ocr") 的子集
+    """
+    engines = []
+
+    try:
+        from pyzbar import pyzbar  # noqa: F401  导入时即加载 zbar 动态库
+        engines.append("barcode")
+    except Exception:
+        pass
+
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        engines.append("ocr")
+    except Exception:
+        pass
+
+    return tuple(engines)
+
+
+def _ocr_lang() -> str:
+    """选择 Tesseract 语言参数"""
+    try:
+        import pytesseract
+        installed = set(pytesseract.get_languages(config=""))
+    except Exception:
+        return "eng"
+    langs = [lang for lang in OCR_LANGS if lang in installed]
+    return "+".join(langs) or "eng"
+
+
+def _recognize(image_data: bytes, max_side: int, engines: tuple, ocr_lang: str,
+               ocr_timeout: float) -> str:
+    """
+    在子进程中执行：解码、缩小、识别
+
+    条码结果在前，OCR 文字在后，以空行分隔。tesseract 超过 ocr_timeout 秒会被结束。
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_data)) as img:
+        # 识别只需灰度图；JPEG 直接以缩小尺寸解码
+        img.draft("L", (max_side, max_side))
+        img = img.convert("L")
+        img.thumbnail((max_side, max_side))
+
+    parts = []
+
+    if "barcode" in engines:
+        from pyzbar import pyzbar
+        for symbol in pyzbar.decode(img):
+            parts.append(symbol.data.decode("utf-8", errors="replace"))
+
+    if "ocr" in engines:
+        import pytesseract
+        text = pytesseract.image_to_string(img, lang=ocr_lang, timeout=ocr_timeout).strip()
+        if text:
+            parts.append(text)
+
+    return "\n\n".join(parts)
+
+
+def _init_worker():
+    """进程池子进程初始化：Ctrl+C 由主进程处理，子进程随进程池终止"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class TextExtractor:
+    """
+    后台文字提取器
+
+    每个任务由一个调度线程提交到进程池并等待结果；超时的任务会导致
+    进程池被终止并在下次提交时重建（单个卡死的识别不会占住进程），
+    同一进程池上被连带终止的任务以各自剩余的时间重新提交。
+    进程池统一使用 spawn 方式创建：重建时服务已是多线程，fork 可能继承他人持有的锁而死锁。
+    排队任务超过 max_pending 时直接丢弃新任务，避免积压的图片数据占满内存。
+    """
+
+    def __init__(self, engines: tuple, processes: int = 2, timeout: float = 15,
+                 max_side: int = 2000, cache_size: int = 256, max_pending: int = 8):
+        self.engines = tuple(engines)
+        self.processes = processes
+        self.timeout = timeout
+        self.max_side = max_side
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self.ocr_lang = _ocr_lang() if "ocr" in self.engines else None
+
+        self._mp = multiprocessing.get_context("spawn")
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._closed = False
+        self._dispatcher = ThreadPoolExecutor(max_workers=processes)
+        self._cache = OrderedDict()  # sha256 -> text
+        self._cache_lock = threading.Lock()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        """预先创建进程池（应在服务启动、请求线程出现之前调用）"""
+        self._get_pool()
+
+    def close(self):
+        """终止进程池（服务退出时调用），进行中和排队的任务直接放弃"""
+        with self._pool_lock:
+            self._closed = True
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+        self._dispatcher.shutdown(wait=False)
+
+    def submit(self, image_data: bytes, callback: Callable[[str], None]) -> bool:
+        """
+        提交识别任务（立即返回）
+
+        识别出非空文字后，在后台线程中调用 callback(text)。
+
+        Returns:
+            bool: 排队已满、任务被丢弃时返回 False
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                print(f"[WARN] 文字识别排队已满（{self.max_pending}），跳过本张图片")
+                return False
+            self._pending += 1
+
+        self._dispatcher.submit(self._run, image_data, callback)
+        return True
+
+    def _run(self, image_data: bytes, callback: Callable[[str], None]):
+        try:
+            self._process(image_data, callback)
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+    def _process(self, image_data: bytes, callback: Callable[[str], None]):
+        key = hashlib.sha256(image_data).hexdigest()
+
+        with self._cache_lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+
+        if text is None:
+            text = self._recognize(image_data)
+            if text is None:
+                return
+            with self._cache_lock:
+                self._cache[key] = text
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        if text:
+            try:
+                callback(text)
+            except Exception as e:
+                print(f"[WARN] 文字结果处理失败: {e}")
+
+    def _recognize(self, image_data: bytes) -> Optional[str]:
+        """
+        提交到进程池并等待结果，超时或失败返回 None
+
+        进程池因其他任务超时被终止时，本任务以剩余时间重新提交到新的进程池，不计为超时。
+        """
+        deadline = time.monotonic() + self.timeout
+        try:
+            while not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"[WARN] 文字识别超时（>{self.timeout}s）")
+                    return None
+
+                pool = self._get_pool()
+                ocr_timeout = max(remaining - TESSERACT_MARGIN, POLL_INTERVAL)
+                args = (image_data, self.max_side, self.engines, self.ocr_lang, ocr_timeout)
+                try:
+                    result = pool.apply_async(_recognize, args)
+                except ValueError:
+                    # 进程池刚被其他任务终止（"Pool not running"），换新池
+                    self._discard_pool(pool)
+                    continue
+
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        print(f"[WARN] 文字识别超时（>{self.timeout}s）")
+                        self._discard_pool(pool)
+                        return None
+                    result.wait(min(remaining, POLL_INTERVAL))
+                    if result.ready():
+                        return result.get()
+                    if self._pool is not pool:
+                        # 进程池被其他超时任务终止（或服务退出），本任务随之丢失，用剩余时间重新提交
+                        break
+        except Exception as e:
+            print(f"[WARN] 文字识别失败: {e}")
+        return None
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._closed:
+                raise RuntimeError("文字提取已关闭")
+            if self._pool is None:
+                self._pool = self._mp.Pool(self.processes, initializer=_init_worker)
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """终止卡住的进程池（已被其他任务终止并替换时不重复终止）"""
+        with self._pool_lock:
+            if self._pool is pool:
+                pool.terminate()
+                self._pool = None
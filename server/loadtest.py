@@ -0,0 +1,460 @@
+"""
+压测模块 - 本机启动服务并模拟多个手机客户端并发上传
+
+用法: python run.py --loadtest [--clients N] [--duration 秒] [--interval 秒]
+
+剪贴板使用空后端（只做图片转换，不写系统剪贴板），报告吞吐量、延迟分位数、
+错误率、线程数和内存增长，用于发现 BytesIO/Pillow 路径上的泄漏。
+模拟客户端运行在独立子进程中，线程数和内存只反映服务端。
+"""
+
+import io
+import os
+import sys
+import ssl
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import signal
+import logging
+import threading
+import multiprocessing
+import http.client
+from collections import Counter
+
+from PIL import Image
+from werkzeug.serving import make_server
+
+from clipboard import set_clipboard_backend
+
+
+# 模拟的拍照尺寸（宽, 高, 格式）：覆盖手机前端 JPEG、原图和截图 PNG
+PAYLOAD_SPECS = [
+    (640, 480, "JPEG"),
+    (1280, 960, "JPEG"),
+    (1920, 1080, "JPEG"),
+    (4032, 3024, "JPEG"),
+    (800, 600, "PNG"),
+    (1170, 2532, "PNG"),
+]
+
+# 上传方式：与手机端/第三方客户端可能使用的三种格式对应
+UPLOAD_MODES = ("multipart", "binary", "json")
+
+# 内存增长从预热结束后开始计算（首轮分配、缓存填充不算泄漏）
+WARMUP_SECONDS = 10
+
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图（内存占用固定，适合长时间运行）
+
+    相邻桶相差约 2%，分位数误差在同一量级。
+    """
+
+    BASE = 1.02
+    MIN_MS = 0.1
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        index = int(math.log(max(ms, self.MIN_MS) / self.MIN_MS, self.BASE))
+        self.buckets[index] += 1
+        self.count += 1
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+        target = math.ceil(self.count * p / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.MIN_MS * self.BASE ** (index + 1), self.max_ms)
+        return self.max_ms
+
+
+class Stats:
+    """客户端进程内所有客户端共享的统计（按报告周期滚动）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset_interval()
+
+    def _reset_interval(self):
+        self.interval = LatencyHistogram()
+        self.interval_bytes = 0
+        self.interval_errors = Counter()
+
+    def record(self, ms: float, size: int, error: str = None):
+        with self.lock:
+            if error:
+                self.interval_errors[error] += 1
+            else:
+                self.interval.add(ms)
+                self.interval_bytes += size
+
+    def roll(self) -> tuple:
+        """结束当前周期，返回 (延迟直方图, 字节数, 错误计数)"""
+        with self.lock:
+            result = (self.interval, self.interval_bytes, self.interval_errors)
+            self._reset_interval()
+            return result
+
+
+def build_payloads(seed: int = 0) -> list:
+    """
+    预先生成测试图片（带噪声，压缩率接近真实照片）
+
+    Returns:
+        list of (bytes, mimetype)
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for width, height, fmt in PAYLOAD_SPECS:
+        noise = Image.effect_noise((width // 8, height // 8), rng.randint(32, 96))
+        img = Image.merge("RGB", [
+            noise.point(lambda v, k=k: (v * k) % 256) for k in (1, 3, 7)
+        ]).resize((width, height))
+        if fmt == "PNG":
+            img = img.convert("RGBA")
+        output = io.BytesIO()
+        img.save(output, format=fmt, quality=85)
+        payloads.append((output.getvalue(), f"image/{fmt.lower()}"))
+    return payloads
+
+
+def _encode_request(image_data: bytes, mimetype: str, mode: str) -> tuple:
+    """按上传方式构造请求体，返回 (body, headers)"""
+    if mode == "binary":
+        return image_data, {"Content-Type": mimetype}
+
+    if mode == "json":
+        b64 = base64.b64encode(image_data).decode("ascii")
+        body = json.dumps({"image": f"data:{mimetype};base64,{b64}"}).encode()
+        return body, {"Content-Type": "application/json"}
+
+    boundary = uuid.uuid4().hex
+    ext = mimetype.split("/")[-1]
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="image"; filename="photo.{ext}"\r\n'.encode(),
+        f"Content-Type: {mimetype}\r\n\r\n".encode(),
+        image_data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+class _ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """建立连接时带上之前的 TLS 会话（模拟手机浏览器重连时的会话复用）"""
+
+    def __init__(self, *args, tls_session=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tls_session = tls_session
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self.tls_session
+        )
+
+
+def _client_loop(client_id: int, host: str, port: int, ssl_context, payloads: list,
+                 stats: Stats, stop: threading.Event, think_ms: float):
+    """单个模拟客户端：循环上传，连接被关闭后带上 TLS 会话重连"""
+    rng = random.Random(client_id)
+    conn = None
+    tls_session = None
+
+    while not stop.is_set():
+        image_data, mimetype = rng.choice(payloads)
+        # 末尾追加随机字节：每次上传内容都不同，避免被最近上传缓存去重
+        image_data += os.urandom(16)
+        body, headers = _encode_request(image_data, mimetype, rng.choice(UPLOAD_MODES))
+
+        start = time.perf_counter()
+        error = None
+        try:
+            if conn is None:
+                if ssl_context:
+                    conn = _ResumingHTTPSConnection(
+                        host, port, timeout=30, context=ssl_context, tls_session=tls_session
+                    )
+                else:
+                    conn = http.client.HTTPConnection(host, port, timeout=30)
+            conn.request("POST", "/api/upload", body=body, headers=headers)
+            # 服务端要求关闭连接时 getresponse() 会清空 conn.sock，先保留引用
+            sock = conn.sock
+            response = conn.getresponse()
+            if ssl_context:
+                # TLS 1.3 的会话票据随响应一起到达，需在连接关闭前取出
+                tls_session = sock.session or tls_session
+            response.read()
+            if response.status != 200:
+                error = f"HTTP {response.status}"
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+                conn = None
+        except Exception as e:
+            error = type(e).__name__
+            if conn is not None:
+                conn.close()
+            conn = None
+
+        stats.record((time.perf_counter() - start) * 1000, len(image_data), error)
+
+        if think_ms > 0:
+            stop.wait(rng.expovariate(1000 / think_ms))
+
+    if conn is not None:
+        conn.close()
+
+
+def _client_process(host: str, port: int, cafile: str, use_tls: bool, clients: int,
+                    think_ms: float, conn):
+    """
+    子进程入口：运行全部模拟客户端，通过管道响应主进程的命令
+
+    启动后先发送负载大小列表；之后收到 "roll" 返回本周期统计，
+    收到 "stop" 停止客户端并返回剩余统计后退出。
+    """
+    # Ctrl+C 由主进程处理，子进程等待 "stop" 命令后有序退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    ssl_context = ssl.create_default_context(cafile=cafile) if use_tls else None
+    payloads = build_payloads()
+    stats = Stats()
+    stop = threading.Event()
+    workers = [
+        threading.Thread(
+            target=_client_loop,
+            args=(i, host, port, ssl_context, payloads, stats, stop, think_ms),
+            daemon=True,
+        )
+        for i in range(clients)
+    ]
+    conn.send([len(data) for data, _ in payloads])
+    for worker in workers:
+        worker.start()
+
+    while True:
+        command = conn.recv()
+        if command == "roll":
+            conn.send(stats.roll())
+        elif command == "stop":
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=35)
+            conn.send(stats.roll())
+            break
+    conn.close()
+
+
+def _rss_bytes():
+    """当前进程常驻内存（字节），无法获取时返回 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    if sys.platform == "win32":
+        return _windows_working_set()
+
+    # Linux: /proc/self/statm 第二列为常驻页数
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _windows_working_set():
+    """Windows: 通过 GetProcessMemoryInfo 读取工作集大小（无需 psutil）"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        kernel32 = ctypes.WinDLL("kernel32")
+        psapi = ctypes.WinDLL("psapi")
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [
+            wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD
+        ]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    except (OSError, AttributeError):
+        pass
+    return None
+
+
+def _format_mb(value) -> str:
+    return "n/a" if value is None else f"{value / 1024 / 1024:.1f}MB"
+
+
+def _print_row(elapsed: float, seconds: float, hist: LatencyHistogram, size: int,
+               errors: Counter, threads: int, rss, growth):
+    requests = hist.count + sum(errors.values())
+    error_rate = sum(errors.values()) / requests * 100 if requests else 0.0
+    growth_str = "warmup" if growth is None else f"{growth / 1024 / 1024:+.1f}MB"
+    print(
+        f"  {elapsed:7.0f}s  {hist.count / seconds:7.1f} req/s  "
+        f"{size / seconds / 1024 / 1024:6.1f} MB/s  "
+        f"p50 {hist.percentile(50):6.1f}  p90 {hist.percentile(90):6.1f}  "
+        f"p99 {hist.percentile(99):7.1f}  max {hist.max_ms:7.1f} ms  "
+        f"err {error_rate:5.2f}%  threads {threads:3d}  "
+        f"rss {_format_mb(rss)} ({growth_str})"
+    )
+
+
+def _print_handshakes(snapshot: dict):
+    print(f"  TLS 握手: {snapshot['total']} 次（复用 {snapshot['resumed']}，失败 {snapshot['failed']}）")
+    for label, key in (("完整", "full_ms"), ("复用", "resumed_ms")):
+        summary = snapshot[key]
+        if summary["count"]:
+            print(f"    {label}握手(ms): p50 {summary['p50']}  p90 {summary['p90']}  max {summary['max']}")
+
+
+def run_loadtest(app, clients: int = 10, duration: float = 60, interval: float = 10,
+                 think_ms: float = 0, port: int = 0, ssl_context=None, cafile: str = None):
+    """
+    启动本地服务并运行压测
+
+    Args:
+        app: Flask 应用
+        clients: 并发模拟客户端数
+        duration: 运行时长（秒），0 表示一直运行到 Ctrl+C
+        interval: 报告周期（秒）
+        think_ms: 每个客户端两次上传之间的平均间隔（毫秒，指数分布）
+        port: 监听端口，0 表示随机可用端口
+        ssl_context: 服务端 SSL 上下文，None 表示 HTTP
+        cafile: 客户端用于校验服务端证书的 CA 文件
+    """
+    set_clipboard_backend("noop")
+    # 逐条请求日志会淹没报告
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    # 与 main() 中 app.run(threaded=True) 相同的服务器实现
+    server = make_server("127.0.0.1", port, app, threaded=True, ssl_context=ssl_context)
+    port = server.server_port
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    print("\n" + "=" * 50)
+    print("  SnapPaste - 压测模式")
+    print("=" * 50)
+    protocol = "https" if ssl_context else "http"
+    print(f"\n  服务器: {protocol}://127.0.0.1:{port}  (剪贴板: noop)")
+    print(f"  客户端: {clients}（独立进程）  时长: {duration or '∞'}s  思考时间: {think_ms}ms")
+
+    # 客户端放在独立进程中：其线程、负载内存和 GIL 竞争不计入服务端的统计
+    base_threads = threading.active_count()
+    mp = multiprocessing.get_context("spawn")
+    conn, child_conn = mp.Pipe()
+    process = mp.Process(
+        target=_client_process,
+        args=("127.0.0.1", port, cafile, bool(ssl_context), clients, think_ms, child_conn),
+        daemon=True,
+    )
+    process.start()
+    child_conn.close()
+
+    sizes = ", ".join(f"{size // 1024}KB" for size in conn.recv())
+    print(f"  负载: {sizes}  方式: {'/'.join(UPLOAD_MODES)}")
+    if _rss_bytes() is None:
+        print("  [WARN] 无法读取进程内存，报告中不含内存增长；请运行: pip install psutil")
+    print("  按 Ctrl+C 提前结束\n")
+
+    total = LatencyHistogram()
+    total_bytes = 0
+    total_errors = Counter()
+
+    start = time.monotonic()
+    baseline_rss = None
+    last = start
+    try:
+        while not duration or time.monotonic() - start < duration:
+            remaining = interval if not duration else min(interval, duration - (time.monotonic() - start))
+            time.sleep(max(remaining, 0))
+            conn.send("roll")
+            hist, size, errors = conn.recv()
+            total.merge(hist)
+            total_bytes += size
+            total_errors.update(errors)
+            now = time.monotonic()
+            rss = _rss_bytes()
+            if baseline_rss is None and now - start >= WARMUP_SECONDS:
+                baseline_rss = rss
+            growth = None if baseline_rss is None or rss is None else rss - baseline_rss
+            # 客户端不在本进程，新增线程即服务端处理线程
+            server_threads = threading.active_count() - base_threads
+            _print_row(now - start, now - last, hist, size, errors, server_threads, rss, growth)
+            last = now
+    except KeyboardInterrupt:
+        print("\n  [INFO] 提前结束")
+
+    # 在客户端退出前采样，避免把连接释放计入内存变化
+    rss = _rss_bytes()
+    conn.send("stop")
+    hist, size, errors = conn.recv()
+    total.merge(hist)
+    total_bytes += size
+    total_errors.update(errors)
+    conn.close()
+    process.join(timeout=5)
+    server.shutdown()
+
+    # 汇总
+    elapsed = time.monotonic() - start
+    requests = total.count + sum(total_errors.values())
+
+    print("\n" + "-" * 50)
+    print(f"  请求总数: {requests}  成功: {total.count}  时长: {elapsed:.1f}s")
+    print(f"  吞吐量:   {total.count / elapsed:.1f} req/s, "
+          f"{total_bytes / elapsed / 1024 / 1024:.1f} MB/s")
+    print(f"  延迟(ms): p50 {total.percentile(50):.1f}  p90 {total.percentile(90):.1f}  "
+          f"p99 {total.percentile(99):.1f}  p99.9 {total.percentile(99.9):.1f}  "
+          f"max {total.max_ms:.1f}")
+    if requests:
+        print(f"  错误率:   {sum(total_errors.values()) / requests * 100:.2f}%")
+    for name, count in total_errors.most_common():
+        print(f"    {name}: {count}")
+    if baseline_rss is not None and rss is not None:
+        print(f"  内存增长: {_format_mb(baseline_rss)} -> {_format_mb(rss)} "
+              f"({(rss - baseline_rss) / 1024 / 1024:+.1f}MB，预热后)")
+    else:
+        print(f"  内存:     {_format_mb(rss)}")
+    handshakes = getattr(ssl_context, "stats", None)
+    if handshakes is not None:
+        _print_handshakes(handshakes.snapshot())
+    print("-" * 50 + "\n")
+
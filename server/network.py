@@ -156,7 +156,7 @@ def _get_ips_unix() -> list:
     return ips
 
 
-def get_local_ip() -> str:
+def get_local_ip(ips: list = None) -> str:
     """
     获取本机最佳局域网 IP 地址
     
@@ -165,8 +165,12 @@ def get_local_ip() -> str:
     2. 有默认网关的接口
     3. 非虚拟机网卡
     4. 第一个可用的局域网 IP
+    
+    Args:
+        ips: 已获取的 get_all_local_ips() 结果，省略时重新获取（需调用 ip/ipconfig）
     """
-    ips = get_all_local_ips()
+    if ips is None:
+        ips = get_all_local_ips()
     
     if not ips:
         # 最后的备用方案
@@ -233,7 +237,7 @@ def print_all_ips():
         gateway_mark = " [有网关]" if ip_info["has_gateway"] else ""
         print(f"  {ip_info['ip']:16} - {ip_info['name']}{gateway_mark}")
     print("-" * 50)
-    print(f"  选择的 IP: {get_local_ip()}\n")
+    print(f"  选择的 IP: {get_local_ip(ips)}\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+"""
+最近上传模块 - 内存中的 LRU 缓存（不落盘），保存原图并按需生成缩略图
+"""
+
+import io
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+
+# 允许的缩略图边长（像素），请求的尺寸会向上取整到其中之一
+THUMB_SIZES = (96, 256, 512)
+THUMB_QUALITY = 80
+
+
+class RecentCaptures:
+    """
+    最近上传的图片（按条数和总字节数双重限制的 LRU）
+
+    条目以内容哈希作为 ID，同一张图重复上传只会刷新其位置。
+    缩略图在首次请求时生成并缓存在条目内，同样计入字节预算。
+    """
+
+    def __init__(self, max_items: int = 20, max_bytes: int = 64 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # id -> entry，末尾为最新
+        self._total_bytes = 0
+        self._version = 0  # 列表每次变化递增，用于 /api/recent 的 ETag
+        self._epoch = f"{int(time.time() * 1000):x}"  # 实例启动标记
+        self._lock = threading.Lock()
+
+    def add(self, image_data: bytes) -> Optional[dict]:
+        """
+        记录一张已写入剪贴板的图片
+
+        Returns:
+            dict: 条目元信息；图片超过总字节预算时不缓存，返回 None
+        """
+        if len(image_data) > self.max_bytes:
+            return None
+
+        item_id = hashlib.sha256(image_data).hexdigest()[:16]
+        fmt, width, height = _probe(image_data)
+
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is None:
+                entry = {
+                    "id": item_id,
+                    "data": image_data,
+                    "format": fmt,
+                    "width": width,
+                    "height": height,
+                    "thumbs": {},
+                }
+                self._entries[item_id] = entry
+                self._total_bytes += len(image_data)
+            else:
+                self._entries.move_to_end(item_id)
+            entry["time"] = time.time()
+            self._version += 1
+            self._evict()
+            return _meta(entry)
+
+    def get(self, item_id: str) -> Optional[bytes]:
+        """取回原图数据，并将其标记为最近使用"""
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(item_id)
+            entry["time"] = time.time()
+            self._version += 1
+            return entry["data"]
+
+    def set_text(self, item_id: str, text: str):
+        """记录从图片中识别出的文字"""
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is not None and entry.get("text") != text:
+                entry["text"] = text
+                self._version += 1
+
+    def list(self) -> tuple:
+        """
+        Returns:
+            tuple: (条目元信息列表（最新在前）, 列表版本标识)
+
+        版本标识包含实例启动标记，服务重启后不会与旧 ETag 冲突
+        """
+        with self._lock:
+            items = [_meta(entry) for entry in reversed(self._entries.values())]
+            return items, f"{self._epoch}-{self._version}"
+
+    def thumbnail(self, item_id: str, size: int) -> Optional[tuple]:
+        """
+        获取缩略图（JPEG），首次请求时生成
+
+        Returns:
+            tuple: (JPEG 数据, 实际边长)；条目不存在时返回 None
+
+        Raises:
+            ValueError: 条目存在但图片无法解码
+        """
+        size = snap_thumb_size(size)
+
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is None:
+                return None
+            cached = entry["thumbs"].get(size)
+            if cached is not None:
+                return cached, size
+            data = entry["data"]
+
+        # 解码放在锁外，避免阻塞其他请求
+        try:
+            thumb = _make_thumbnail(data, size)
+        except Exception as e:
+            print(f"[WARN] 缩略图生成失败: {e}")
+            raise ValueError(f"Cannot decode image: {e}") from e
+
+        with self._lock:
+            # 生成期间条目可能已被淘汰，此时只返回结果不缓存
+            entry = self._entries.get(item_id)
+            if entry is not None and size not in entry["thumbs"]:
+                entry["thumbs"][size] = thumb
+                self._total_bytes += len(thumb)
+                self._evict()
+        return thumb, size
+
+    def _evict(self):
+        """淘汰最旧的条目直到满足限制（调用方需持有锁），最新条目始终保留"""
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_items or self._total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= _entry_bytes(entry)
+            self._version += 1
+
+
+def snap_thumb_size(size: int) -> int:
+    """将请求的边长向上取整到允许的缩略图尺寸"""
+    for allowed in THUMB_SIZES:
+        if size <= allowed:
+            return allowed
+    return THUMB_SIZES[-1]
+
+
+def _probe(image_data: bytes) -> tuple:
+    """只读取图片头部，获取格式和尺寸"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return img.format, img.width, img.height
+    except Exception:
+        return None, None, None
+
+
+def _make_thumbnail(image_data: bytes, size: int) -> bytes:
+    """生成缩略图：JPEG 用 draft 在解码阶段缩小，其余格式用 reduce 整数倍缩小"""
+    with Image.open(io.BytesIO(image_data)) as img:
+        # JPEG 可直接以 1/2、1/4、1/8 尺寸解码，大幅减少解码开销
+        img.draft("RGB", (size, size))
+
+        # reduce 不支持 P / 1 / I;16 等模式，先统一为 RGB 或 L
+        img = _to_thumb_mode(img)
+
+        factor = max(img.width, img.height) // size
+        if factor >= 2:
+            img = img.reduce(factor)
+
+        img.thumbnail((size, size))
+
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=THUMB_QUALITY)
+        return output.getvalue()
+
+
+def _to_thumb_mode(img):
+    """转换为 JPEG 可保存的 RGB / L 模式，透明部分填充白色（与剪贴板 DIB 一致）"""
+    if img.mode in ("RGB", "L"):
+        return img
+
+    if img.mode.startswith("I;16"):
+        # 16 位灰度：缩放到 8 位，否则 convert("L") 会直接截断
+        img = img.convert("I").point(lambda v: v / 256)
+
+    if img.mode in ("1", "I", "F"):
+        return img.convert("L")
+
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+
+    return img.convert("RGB")
+
+
+def _meta(entry: dict) -> dict:
+    """条目对外暴露的元信息（不含图片数据）"""
+    return {
+        "id": entry["id"],
+        "size": len(entry["data"]),
+        "format": entry["format"],
+        "width": entry["width"],
+        "height": entry["height"],
+        "time": entry["time"],
+        "text": entry.get("text"),
+    }
+
+
+def _entry_bytes(entry: dict) -> int:
+    return len(entry["data"]) + sum(len(t) for t in entry["thumbs"].values())
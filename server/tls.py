@@ -0,0 +1,444 @@
+"""
+TLS 模块 - 本地 CA + 短期叶子证书，复用 SSL 上下文并统计握手开销
+
+证书目录结构:
+    ca-cert.pem / ca-key.pem   长期有效的本地 CA（手机信任一次即可）
+    cert.pem / key.pem         CA 签发的短期叶子证书（含证书链），覆盖本机所有局域网 IP
+
+叶子证书到期前或本机 IP 变化时自动重新签发；只要手机信任了 CA，就不会再次提示。
+"""
+
+import os
+import ssl
+import time
+import socket
+import threading
+import ipaddress
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from network import get_all_local_ips, get_local_ip
+
+
+CA_DAYS = 3650          # CA 有效期
+LEAF_DAYS = 30          # 叶子证书有效期
+RENEW_DAYS = 7          # 剩余有效期不足时重新签发
+HANDSHAKE_TIMEOUT = 10  # 握手超时（秒），防止半开连接卡住 accept 线程
+REFRESH_INTERVAL = 60   # 运行中检查 IP 变化的间隔（秒）
+
+# CA 的名称约束：只能为这些名称签发证书。CA 会被手机设为信任锚点，
+# 即使 ca-key.pem 泄漏，也无法借此冒充公网网站
+PERMITTED_DNS = ("localhost",)
+PERMITTED_NETWORKS = ("10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "127.0.0.0/8")
+
+
+class HandshakeStats:
+    """TLS 握手统计（线程安全），区分完整握手和会话复用"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)  # (耗时毫秒, 是否复用)
+        self.total = 0
+        self.resumed = 0
+        self.failed = 0
+
+    def record(self, ms: float, resumed: bool):
+        with self._lock:
+            self.total += 1
+            if resumed:
+                self.resumed += 1
+            self._recent.append((ms, resumed))
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: 累计次数，以及最近窗口内完整握手/复用握手的耗时分布（毫秒）
+        """
+        with self._lock:
+            recent = list(self._recent)
+            result = {
+                "total": self.total,
+                "resumed": self.resumed,
+                "failed": self.failed,
+            }
+        result["full_ms"] = _summarize([ms for ms, resumed in recent if not resumed])
+        result["resumed_ms"] = _summarize([ms for ms, resumed in recent if resumed])
+        return result
+
+
+def _summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values.sort()
+    return {
+        "count": len(values),
+        "p50": round(values[len(values) // 2], 2),
+        "p90": round(values[min(len(values) - 1, int(len(values) * 0.9))], 2),
+        "max": round(values[-1], 2),
+    }
+
+
+class InstrumentedSSLContext(ssl.SSLContext):
+    """
+    服务端 SSL 上下文：显式完成并计时每个连接的握手
+
+    werkzeug 先包装监听 socket，accept() 时再用同一个上下文包装新连接；
+    只对已连接的 socket 计时，握手仍发生在 accept 时（与默认行为一致）。
+    证书更新后新连接改用 replacement：SSL_CTX 在其他线程使用时不能重新加载证书。
+    """
+
+    stats = None
+    replacement = None
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if not (server_side and do_handshake_on_connect and _is_connected(sock)):
+            return super().wrap_socket(
+                sock, server_side=server_side,
+                do_handshake_on_connect=do_handshake_on_connect,
+                suppress_ragged_eofs=suppress_ragged_eofs,
+                server_hostname=server_hostname, session=session
+            )
+
+        context = self.replacement or self
+        ssl_sock = ssl.SSLContext.wrap_socket(
+            context, sock, server_side=True, do_handshake_on_connect=False,
+            suppress_ragged_eofs=suppress_ragged_eofs
+        )
+        timeout = ssl_sock.gettimeout()
+        ssl_sock.settimeout(HANDSHAKE_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            ssl_sock.do_handshake()
+        except Exception:
+            if self.stats:
+                self.stats.record_failure()
+            ssl_sock.close()
+            raise
+        if self.stats:
+            self.stats.record((time.perf_counter() - start) * 1000, ssl_sock.session_reused)
+        ssl_sock.settimeout(timeout)
+        return ssl_sock
+
+
+def _is_connected(sock) -> bool:
+    try:
+        sock.getpeername()
+        return True
+    except OSError:
+        return False
+
+
+class CertManager:
+    """
+    管理本地 CA 和叶子证书，并提供复用的服务端 SSL 上下文
+    """
+
+    def __init__(self, cert_dir: str):
+        self.cert_dir = cert_dir
+        self.ca_cert_file = os.path.join(cert_dir, "ca-cert.pem")
+        self.ca_key_file = os.path.join(cert_dir, "ca-key.pem")
+        self.cert_file = os.path.join(cert_dir, "cert.pem")
+        self.key_file = os.path.join(cert_dir, "key.pem")
+        self.stats = HandshakeStats()
+        self._context = None
+        self._checked = None  # (上次检查时的 IP 列表, 需要续期的时间)
+        self._lock = threading.Lock()
+
+    def ensure(self) -> tuple:
+        """
+        确保 CA 和覆盖当前所有 IP 的有效叶子证书存在
+
+        Returns:
+            tuple: (cert_file, key_file)；未安装 cryptography 时返回 (None, None)
+        """
+        try:
+            with self._lock:
+                self._ensure_files()
+            return self.cert_file, self.key_file
+        except ImportError:
+            print("[WARN] 未安装 cryptography，无法生成证书")
+            print("[WARN] 请运行: pip install cryptography")
+            return None, None
+
+    def ssl_context(self):
+        """
+        服务端 SSL 上下文（同一进程内只创建一次，所有连接共享会话缓存和票据密钥）
+
+        Returns:
+            InstrumentedSSLContext；证书不可用时返回 None
+        """
+        if self._context is not None:
+            return self._context
+
+        cert_file, key_file = self.ensure()
+        if not cert_file:
+            return None
+
+        self._context = self._new_context()
+        return self._context
+
+    def refresh(self):
+        """
+        叶子证书临近过期或 IP 变化时重新签发，并换上新建的上下文（仅影响新连接）
+
+        IP 未变且未到续期时间时只比较列表，不读取证书文件，可以频繁调用。
+        新上下文的票据密钥不同，换证书后手机的第一次重连是完整握手。
+        """
+        ips = current_ips()
+        with self._lock:
+            if self._checked and self._checked[0] == ips and _now() < self._checked[1]:
+                return
+            if not self._ensure_files(ips):
+                return
+            if self._context is not None:
+                self._context.replacement = self._new_context()
+
+    def _new_context(self):
+        context = InstrumentedSSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        # 会话复用：TLS 1.2 会话缓存 + 会话票据，TLS 1.3 每次握手下发票据
+        context.options &= ~ssl.OP_NO_TICKET
+        if hasattr(context, "num_tickets"):
+            context.num_tickets = 2
+        context.load_cert_chain(self.cert_file, self.key_file)
+        context.stats = self.stats
+        return context
+
+    def start_auto_refresh(self, interval: float = REFRESH_INTERVAL):
+        """
+        后台定期调用 refresh()
+
+        电脑切换网络后约一分钟内即换上覆盖新 IP 的证书，信任了 CA 的手机不会看到证书错误。
+        """
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"[WARN] 证书更新失败: {e}")
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def ca_cert_der(self):
+        """CA 证书（DER 格式，供手机下载安装）；尚未生成时返回 None"""
+        try:
+            from cryptography import x509
+            from cryptography.hazmat.primitives import serialization
+            with open(self.ca_cert_file, "rb") as f:
+                ca_cert = x509.load_pem_x509_certificate(f.read())
+            return ca_cert.public_bytes(serialization.Encoding.DER)
+        except (ImportError, OSError, ValueError):
+            return None
+
+    def leaf_expiry(self):
+        """叶子证书到期时间（UTC），不可用时返回 None"""
+        try:
+            from cryptography import x509
+            with open(self.cert_file, "rb") as f:
+                return _not_after(x509.load_pem_x509_certificate(f.read()))
+        except (ImportError, OSError, ValueError):
+            return None
+
+    def _ensure_files(self, ips: list = None) -> bool:
+        """检查并按需生成证书文件，返回是否签发了新的叶子证书（调用方需持有锁）"""
+        os.makedirs(self.cert_dir, exist_ok=True)
+        ca_cert, ca_key = self._load_or_create_ca()
+
+        if ips is None:
+            ips = current_ips()
+        # CA 受名称约束，只有私有/回环地址能写入叶子证书
+        cert_ips = [ip for ip in ips if _is_permitted_ip(ip)]
+        issued = not self._leaf_is_valid(ca_cert, cert_ips)
+        if issued:
+            self._issue_leaf(ca_cert, ca_key, cert_ips)
+
+        self._checked = (ips, self.leaf_expiry() - timedelta(days=RENEW_DAYS))
+        return issued
+
+    def _load_or_create_ca(self) -> tuple:
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        if os.path.exists(self.ca_cert_file) and os.path.exists(self.ca_key_file):
+            with open(self.ca_cert_file, "rb") as f:
+                ca_cert = x509.load_pem_x509_certificate(f.read())
+            with open(self.ca_key_file, "rb") as f:
+                ca_key = serialization.load_pem_private_key(f.read(), password=None)
+            if _not_after(ca_cert) > _now() + timedelta(days=RENEW_DAYS):
+                return ca_cert, ca_key
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, f"SnapPaste Local CA ({socket.gethostname()})"),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "SnapPaste"),
+        ])
+        now = _now()
+        ca_cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(minutes=5))
+            .not_valid_after(now + timedelta(days=CA_DAYS))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+            .add_extension(x509.NameConstraints(
+                permitted_subtrees=[x509.DNSName(name) for name in PERMITTED_DNS]
+                + [x509.IPAddress(ipaddress.ip_network(net)) for net in PERMITTED_NETWORKS],
+                excluded_subtrees=None
+            ), critical=True)
+            .add_extension(x509.KeyUsage(
+                digital_signature=False, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                crl_sign=True, encipher_only=False, decipher_only=False
+            ), critical=True)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+            .sign(key, hashes.SHA256())
+        )
+
+        _write_private_key(self.ca_key_file, key)
+        _write_file(self.ca_cert_file, ca_cert.public_bytes(serialization.Encoding.PEM))
+
+        print(f"[INFO] 已生成本地 CA 证书: {self.ca_cert_file}")
+        return ca_cert, key
+
+    def _leaf_is_valid(self, ca_cert, ips: list) -> bool:
+        """叶子证书存在、由当前 CA 签发、与私钥匹配、未临近过期且覆盖所有 IP"""
+        from cryptography import x509
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        if not (os.path.exists(self.cert_file) and os.path.exists(self.key_file)):
+            return False
+
+        try:
+            with open(self.cert_file, "rb") as f:
+                leaf = x509.load_pem_x509_certificate(f.read())
+            ca_cert.public_key().verify(
+                leaf.signature, leaf.tbs_certificate_bytes,
+                ec.ECDSA(leaf.signature_hash_algorithm)
+            )
+            san = leaf.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+            # 私钥与证书不匹配（例如两次写入之间崩溃）时 ssl_context() 会加载失败
+            ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).load_cert_chain(self.cert_file, self.key_file)
+        except Exception:
+            # 旧版自签名证书、其他 CA 签发、私钥不匹配或文件损坏
+            return False
+
+        if _not_after(leaf) < _now() + timedelta(days=RENEW_DAYS):
+            return False
+
+        covered = {str(ip) for ip in san.get_values_for_type(x509.IPAddress)}
+        return set(ips) <= covered
+
+    def _issue_leaf(self, ca_cert, ca_key, ips: list):
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        # ECDSA P-256：签名比 RSA-2048 快一个数量级，完整握手开销更低
+        key = ec.generate_private_key(ec.SECP256R1())
+
+        san = x509.SubjectAlternativeName(
+            [x509.DNSName("localhost")]
+            + [x509.IPAddress(ipaddress.ip_address(ip)) for ip in ips]
+        )
+
+        now = _now()
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([
+                x509.NameAttribute(NameOID.COMMON_NAME, f"SnapPaste ({socket.gethostname()})"),
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME, "SnapPaste"),
+            ]))
+            .issuer_name(ca_cert.subject)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(minutes=5))
+            .not_valid_after(now + timedelta(days=LEAF_DAYS))
+            .add_extension(san, critical=False)
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+            .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+            .add_extension(
+                x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_cert.public_key()),
+                critical=False
+            )
+            .sign(ca_key, hashes.SHA256())
+        )
+
+        _write_private_key(self.key_file, key)
+        # 叶子证书 + CA 证书组成证书链
+        _write_file(
+            self.cert_file,
+            cert.public_bytes(serialization.Encoding.PEM) + ca_cert.public_bytes(serialization.Encoding.PEM)
+        )
+
+        print(f"[INFO] 已签发证书（{LEAF_DAYS} 天，覆盖 {', '.join(ips)}）: {self.cert_file}")
+
+
+def _is_permitted_ip(ip: str) -> bool:
+    """IP 是否在 CA 名称约束允许的网段内"""
+    address = ipaddress.ip_address(ip)
+    if any(address in ipaddress.ip_network(net) for net in PERMITTED_NETWORKS):
+        return True
+    print(f"[WARN] {ip} 不是私有局域网地址，CA 无法为其签发证书，手机通过该地址访问会报证书错误")
+    return False
+
+
+def current_ips() -> list:
+    """证书需要覆盖的 IP：所有局域网地址 + 横幅/二维码中的地址 + 回环"""
+    all_ips = get_all_local_ips()
+    ips = {ip["ip"] for ip in all_ips}
+    # 接口解析失败时 get_local_ip() 会退回 UDP 探测地址，它才是手机实际访问的 URL
+    ips.add(get_local_ip(all_ips))
+    ips.add("127.0.0.1")
+    return sorted(ips)
+
+
+def _write_private_key(path: str, key):
+    from cryptography.hazmat.primitives import serialization
+
+    _write_file(path, key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    ), private=True)
+
+
+def _write_file(path: str, data: bytes, private: bool = False):
+    """
+    先写临时文件再 os.replace，崩溃时不会留下写了一半的文件
+
+    证书和私钥分别替换，两次替换之间崩溃导致的不匹配由 _leaf_is_valid 检出并重新签发。
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        if private:
+            try:
+                os.chmod(tmp, 0o600)
+            except OSError:
+                pass
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _not_after(cert) -> datetime:
+    """证书到期时间（兼容新旧版本 cryptography）"""
+    not_after = getattr(cert, "not_valid_after_utc", None)
+    if not_after is None:
+        not_after = cert.not_valid_after.replace(tzinfo=timezone.utc)
+    return not_after
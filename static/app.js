@@ -5,6 +5,7 @@
 
 const UPLOAD_URL = '/api/upload';
 const JPEG_QUALITY = 0.85;
+const TOKEN_KEY = 'snappaste-token';
 
 // ============ DOM 元素 ============
 const video = document.getElementById('camera');
@@ -481,6 +482,7 @@ async function uploadImage(blob) {
   
   const response = await fetch(UPLOAD_URL, {
     method: 'POST',
+    headers: authHeaders(),
     body: formData
   });
   
@@ -527,6 +529,21 @@ function hideError() {
   errorOverlay.classList.add('hidden');
 }
 
+// 访问令牌：二维码 URL 中的 ?token= 由服务端每次启动生成，读取最近上传等接口时需带上
+function initAccessToken() {
+  const token = new URLSearchParams(location.search).get('token');
+  if (token) {
+    localStorage.setItem(TOKEN_KEY, token);
+    // 从地址栏移除，避免出现在截图或分享的链接中
+    history.replaceState(null, '', location.pathname);
+  }
+}
+
+function authHeaders() {
+  const token = localStorage.getItem(TOKEN_KEY);
+  return token ? { 'X-SnapPaste-Token': token } : {};
+}
+
 async function registerServiceWorker() {
   if ('serviceWorker' in navigator) {
     try {
@@ -600,6 +617,7 @@ window.addEventListener('resize', () => {
 
 // ============ 初始化 ============
 document.addEventListener('DOMContentLoaded', () => {
+  initAccessToken();
   initCamera();
   registerServiceWorker();
 });